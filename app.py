@@ -2,13 +2,19 @@ import os
 import sqlite3
 import requests
 import time
-import json
+import orjson
 import click
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
-from flask import Flask, render_template, jsonify
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, stream_with_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
 import logging
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -22,37 +28,98 @@ app.config["DATABASE"] = os.environ.get("DATABASE_PATH", "./airq.db")
 if not app.config["SECRET_KEY"]:
     raise ValueError("SECRET_KEY must be set in environment variables")
 
-# Global variable to track if background thread is started
-_background_thread_started = False
+# Set once the background thread is started; the lock guards starting it
+_bg_started = threading.Event()
+_bg_lock = threading.Lock()
+
+# Per-thread reader connections and a single lock-protected writer connection
+_db_local = threading.local()
+_db_write_lock = threading.Lock()
+_db_writer = None
+
+# Applied once to every new connection
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+# Standardized measurement, with fields in measurements table column order
+MeasurementRow = namedtuple(
+    "MeasurementRow",
+    "device_id timestamp timestamp_epoch pm1 pm2 pm10 co2 temperature humidity nox tvoc",
+)
+
+# Active device settings; config holds raw provider-specific JSON
+DeviceConfig = namedtuple(
+    "DeviceConfig", "id name provider api_token location_id config"
+)
+
+_INSERT_MEASUREMENT_SQL = (
+    f"INSERT INTO measurements ({', '.join(MeasurementRow._fields)}) "
+    f"VALUES ({', '.join('?' * len(MeasurementRow._fields))})"
+)
 
 # Configuration
 FETCH_INTERVAL = 60
+DEVICE_CHECK_INTERVAL = 5
+# Longest a fetch cycle waits for slow devices before storing what it has
+FETCH_CYCLE_TIMEOUT = 15
+HISTORY_CHUNK_ROWS = 500
+HISTORY_MAX_POINTS = 500
+
+# Active device list for the data fetcher, reloaded whenever devices_version
+# changes; only the fetcher thread reads or writes it
+_devices_cache = {"version": None, "rows": []}
+
+# Worker pool for fetching devices concurrently
+_POOL = ThreadPoolExecutor(max_workers=16)
+
+# Adapters reused across fetch cycles, keyed by device ID
+_adapter_cache = {}
 
 
 def get_configured_devices():
     """Load devices from database."""
-    conn = sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
 
     cursor.execute(
         """
-        SELECT id, name, provider, config 
+        SELECT id, name, provider, api_token, location_id, config
         FROM devices 
         WHERE active = 1
         ORDER BY id
         """
     )
 
-    devices = []
-    for row in cursor.fetchall():
-        device_id, name, provider, config_json = row
-        config = json.loads(config_json)
-        devices.append(
-            {"id": device_id, "name": name, "provider": provider, "config": config}
-        )
+    return [DeviceConfig(*row) for row in cursor.fetchall()]
+
+
+def get_devices_version():
+    """Return the counter bumped by triggers whenever the devices table changes."""
+    cursor = get_db_connection().cursor()
+    cursor.execute("SELECT version FROM devices_version WHERE id = 1")
+    return cursor.fetchone()[0]
+
+
+def get_cached_devices():
+    """Return active devices and the devices_version they were loaded at.
+
+    The list is reloaded whenever devices_version changes.
 
-    conn.close()
-    return devices
+    Device changes come from the separate ``flask device`` CLI process, so
+    the version counter in the database is the only signal we can rely on.
+    """
+    version = get_devices_version()
+    if version != _devices_cache["version"]:
+        rows = get_configured_devices()
+        _devices_cache["rows"] = rows
+        _devices_cache["version"] = version
+    return _devices_cache["rows"], version
 
 
 # Configure logging
@@ -60,17 +127,37 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def normalize_timestamp(api_timestamp):
+    """Convert an API timestamp into the stored UTC string and epoch seconds."""
+    if api_timestamp:
+        # Parse timestamp from API and store as UTC; naive input is assumed UTC
+        utc_dt = datetime.fromisoformat(api_timestamp.replace("Z", "+00:00"))
+        if utc_dt.tzinfo:
+            utc_dt = utc_dt.astimezone(timezone.utc)
+        else:
+            utc_dt = utc_dt.replace(tzinfo=timezone.utc)
+    else:
+        # Fallback to current UTC time
+        utc_dt = datetime.now(timezone.utc)
+
+    return utc_dt.strftime("%Y-%m-%d %H:%M:%S"), int(utc_dt.timestamp())
+
+
 class DeviceAdapter(ABC):
     """Abstract base class for device adapters."""
 
     def __init__(self, device_config):
         self.device_config = device_config
-        self.name = device_config["name"]
-        self.device_id = device_config["id"]
+        self.name = device_config.name
+        self.device_id = device_config.id
 
     @abstractmethod
     def fetch_data(self):
-        """Fetch data from device and return standardized measurement dict."""
+        """Fetch data from device and return a standardized MeasurementRow."""
+        pass
+
+    def close(self):
+        """Release any resources held by the adapter."""
         pass
 
     def get_device_info(self):
@@ -78,51 +165,73 @@ class DeviceAdapter(ABC):
         return {
             "id": self.device_id,
             "name": self.name,
-            "provider": self.device_config["provider"],
+            "provider": self.device_config.provider,
         }
 
 
+def create_http_session():
+    """Create a pooled HTTP session so keep-alive connections are reused."""
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.2),
+        ),
+    )
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
 class AirGradientAdapter(DeviceAdapter):
     """Adapter for AirGradient devices."""
 
     def __init__(self, device_config):
         super().__init__(device_config)
-        self.api_token = device_config["config"]["api_token"]
-        self.location_id = device_config["config"]["location_id"]
+        self.api_token = device_config.api_token
+        self.location_id = device_config.location_id
         self.api_base_url = "https://api.airgradient.com/public/api/v1"
+        self.session = create_http_session()
 
     def fetch_data(self):
         """Fetch data from AirGradient API."""
         try:
             url = f"{self.api_base_url}/locations/{self.location_id}/measures/current?token={self.api_token}"
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             response.raise_for_status()
 
             data = response.json()
             logger.info(f"Fetched data from {self.name}: {data}")
 
             # Convert AirGradient format to standardized format
-            return {
-                "device_id": self.device_id,
-                "timestamp": data.get("timestamp"),
-                "pm1": data.get("pm01"),
-                "pm2": data.get("pm02"),
-                "pm10": data.get("pm10"),
-                "co2": data.get("rco2"),
-                "temperature": data.get("atmp"),
-                "humidity": data.get("rhum"),
-                "nox": data.get("noxIndex"),
-                "tvoc": data.get("tvocIndex"),
-            }
+            timestamp, timestamp_epoch = normalize_timestamp(data.get("timestamp"))
+            return MeasurementRow(
+                self.device_id,
+                timestamp,
+                timestamp_epoch,
+                data.get("pm01"),
+                data.get("pm02"),
+                data.get("pm10"),
+                data.get("rco2"),
+                data.get("atmp"),
+                data.get("rhum"),
+                data.get("noxIndex"),
+                data.get("tvocIndex"),
+            )
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching data from {self.name}: {e}")
             return None
 
+    def close(self):
+        """Close the pooled HTTP session."""
+        self.session.close()
+
 
 def create_device_adapter(device_config):
     """Factory function to create appropriate device adapter."""
-    device_provider = device_config["provider"]
+    device_provider = device_config.provider
 
     if device_provider == "airgradient":
         return AirGradientAdapter(device_config)
@@ -130,15 +239,49 @@ def create_device_adapter(device_config):
         raise ValueError(f"Unknown device provider: {device_provider}")
 
 
+def get_or_create_adapter(device_config):
+    """Return the cached adapter for a device, rebuilding it if its config changed."""
+    cached = _adapter_cache.get(device_config.id)
+    if cached and cached[0] == device_config:
+        return cached[1]
+
+    adapter = create_device_adapter(device_config)
+    _adapter_cache[device_config.id] = (device_config, adapter)
+    if cached:
+        cached[1].close()
+    return adapter
+
+
 def init_database():
     """Initialize the SQLite database with required tables."""
-    conn = sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
-    cursor = conn.cursor()
-    
-    # Enable WAL mode for better concurrent access
-    cursor.execute("PRAGMA journal_mode=WAL")
-    cursor.execute("PRAGMA synchronous=NORMAL")
+    with db_writer() as conn:
+        _create_schema(conn.cursor())
+    logger.info("Database initialized")
+
+
+# id is a plain ROWID alias: AUTOINCREMENT would cost a sqlite_sequence
+# update on every insert, and measurement ids never need to be non-reusable
+_CREATE_MEASUREMENTS_SQL = """
+    CREATE TABLE IF NOT EXISTS measurements (
+        id INTEGER PRIMARY KEY,
+        device_id INTEGER NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        timestamp_epoch INTEGER,
+        pm1 REAL,
+        pm2 REAL,
+        pm10 REAL,
+        co2 INTEGER,
+        temperature REAL,
+        humidity REAL,
+        nox INTEGER,
+        tvoc INTEGER,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+"""
+
 
+def _create_schema(cursor):
+    """Create tables and indexes if they do not exist yet."""
     # Create devices table
     cursor.execute(
         """
@@ -146,6 +289,8 @@ def init_database():
             id INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
             provider TEXT NOT NULL,
+            api_token TEXT,
+            location_id TEXT,
             config JSON,
             active BOOLEAN DEFAULT 1,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
@@ -153,130 +298,208 @@ def init_database():
     """
     )
 
-    # Create measurements table with device_id
+    # Single-row counter bumped on every device change, so server processes
+    # notice edits made by the CLI
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS measurements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id INTEGER NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            pm1 REAL,
-            pm2 REAL,
-            pm10 REAL,
-            co2 INTEGER,
-            temperature REAL,
-            humidity REAL,
-            nox INTEGER,
-            tvoc INTEGER,
-            FOREIGN KEY (device_id) REFERENCES devices (id)
+        CREATE TABLE IF NOT EXISTS devices_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
         )
     """
     )
+    cursor.execute("INSERT OR IGNORE INTO devices_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS devices_version_{event.lower()}
+            AFTER {event} ON devices
+            BEGIN
+                UPDATE devices_version SET version = version + 1 WHERE id = 1;
+            END
+        """
+        )
+
+    # Create measurements table with device_id
+    cursor.execute(_CREATE_MEASUREMENTS_SQL)
+
+    # Migrate older databases that kept AirGradient settings only in the
+    # config JSON; the JSON is left in place so older releases keep working
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(devices)")}
+    if "api_token" not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN api_token TEXT")
+        cursor.execute("ALTER TABLE devices ADD COLUMN location_id TEXT")
+        cursor.execute(
+            """
+            UPDATE devices
+            SET api_token = json_extract(config, '$.api_token'),
+                location_id = json_extract(config, '$.location_id')
+            WHERE provider = 'airgradient'
+        """
+        )
+
+    # Migrate older databases that predate the integer epoch column
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(measurements)")}
+    if "timestamp_epoch" not in columns:
+        cursor.execute("ALTER TABLE measurements ADD COLUMN timestamp_epoch INTEGER")
+        cursor.execute(
+            """
+            UPDATE measurements
+            SET timestamp_epoch = CAST(strftime('%s', timestamp) AS INTEGER)
+        """
+        )
+
+    # Rebuild older measurements tables that were created with AUTOINCREMENT
+    table_sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'measurements'"
+    ).fetchone()["sql"]
+    if "AUTOINCREMENT" in table_sql.upper():
+        column_list = ", ".join(("id",) + MeasurementRow._fields)
+        cursor.execute("ALTER TABLE measurements RENAME TO measurements_old")
+        cursor.execute(_CREATE_MEASUREMENTS_SQL)
+        cursor.execute(
+            f"INSERT INTO measurements ({column_list}) "
+            f"SELECT {column_list} FROM measurements_old"
+        )
+        cursor.execute("DROP TABLE measurements_old")
 
     # Create indexes for faster queries
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS idx_timestamp ON measurements(timestamp)
+        CREATE INDEX IF NOT EXISTS idx_timestamp_epoch ON measurements(timestamp_epoch)
     """
     )
 
+    # Covering index so per-device history reads never touch the table
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS idx_device_timestamp ON measurements(device_id, timestamp)
+        CREATE INDEX IF NOT EXISTS idx_device_epoch_covering ON measurements(
+            device_id, timestamp_epoch, pm2, co2, temperature, humidity, tvoc, nox
+        )
     """
     )
 
-    # Database initialization complete - devices will be added via CLI
+    # Lets the per-device latest-measurement lookup seek straight to the tail
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_measurements_device_id_desc
+        ON measurements(device_id, id DESC)
+    """
+    )
 
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized")
+    # Superseded by the epoch-based indexes above
+    for index in ("idx_timestamp", "idx_device_timestamp", "idx_device_ts_covering"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index}")
 
+    # Database initialization complete - devices will be added via CLI
 
-def store_measurement(data):
-    """Store measurement data in SQLite database."""
-    if not data:
-        return
 
-    conn = sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
-    cursor = conn.cursor()
+def store_measurements_batch(rows):
+    """Store measurement rows in SQLite with a single transaction."""
+    if not rows:
+        return
 
     try:
-        # Store UTC timestamps
-        api_timestamp = data.get("timestamp")
-        if api_timestamp:
-            # Parse UTC timestamp from API and store as UTC
-            utc_dt = datetime.fromisoformat(api_timestamp.replace("Z", "+00:00"))
-            timestamp_str = utc_dt.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            # Fallback to current UTC time
-            timestamp_str = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
-        cursor.execute(
-            """
-            INSERT INTO measurements 
-            (device_id, timestamp, pm1, pm2, pm10, co2, temperature, humidity, nox, tvoc)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                data.get("device_id"),
-                timestamp_str,
-                data.get("pm1"),
-                data.get("pm2"),
-                data.get("pm10"),
-                data.get("co2"),
-                data.get("temperature"),
-                data.get("humidity"),
-                data.get("nox"),
-                data.get("tvoc"),
-            ),
-        )
+        with db_writer() as conn:
+            conn.executemany(_INSERT_MEASUREMENT_SQL, rows)
 
-        conn.commit()
-        logger.info(
-            f"Measurement stored successfully for device {data.get('device_id')} at {timestamp_str} UTC"
-        )
+        logger.info(f"Stored {len(rows)} measurement(s) successfully")
 
     except sqlite3.Error as e:
         logger.error(f"Database error: {e}")
-    finally:
-        conn.close()
+
+
+def fetch_device(device_config):
+    """Fetch the current measurement for a single device."""
+    return get_or_create_adapter(device_config).fetch_data()
 
 
 def data_fetcher():
     """Background thread function to fetch data periodically from all devices."""
     while True:
+        version = None
         try:
-            devices = get_configured_devices()
+            devices, version = get_cached_devices()
+
+            # Drop adapters for devices that are no longer active
+            active_ids = {device_config.id for device_config in devices}
+            for stale_id in _adapter_cache.keys() - active_ids:
+                _adapter_cache.pop(stale_id)[1].close()
+
             if not devices:
                 logger.warning(
                     "No devices configured. Use 'flask device add' to add devices."
                 )
             else:
-                for device_config in devices:
-                    try:
-                        adapter = create_device_adapter(device_config)
-                        data = adapter.fetch_data()
-                        if data:
-                            store_measurement(data)
-                        else:
-                            logger.warning(
-                                f"No data received from {device_config['name']}"
+                futures = {
+                    _POOL.submit(fetch_device, device_config): device_config
+                    for device_config in devices
+                }
+                rows = []
+                try:
+                    for future in as_completed(futures, timeout=FETCH_CYCLE_TIMEOUT):
+                        device_config = futures[future]
+                        try:
+                            data = future.result()
+                            if data:
+                                rows.append(data)
+                            else:
+                                logger.warning(
+                                    f"No data received from {device_config.name}"
+                                )
+                        except Exception as e:
+                            logger.error(
+                                f"Error fetching data from {device_config.name}: {e}"
                             )
-                    except Exception as e:
-                        logger.error(
-                            f"Error fetching data from {device_config['name']}: {e}"
-                        )
+                except FuturesTimeoutError:
+                    # Don't let an unreachable device hold up everyone else's rows
+                    pending = [
+                        device_config.name
+                        for future, device_config in futures.items()
+                        if not future.done()
+                    ]
+                    logger.warning(
+                        f"Skipping devices still fetching after {FETCH_CYCLE_TIMEOUT}s: "
+                        f"{', '.join(pending)}"
+                    )
+                store_measurements_batch(rows)
         except Exception as e:
             logger.error(f"Error in data fetcher: {e}")
 
-        time.sleep(FETCH_INTERVAL)
+        wait_for_next_cycle(version)
+
+
+def wait_for_next_cycle(version):
+    """Sleep until the next fetch cycle, waking early if devices change.
+
+    Device changes are made by the CLI in another process, so poll the
+    devices_version counter rather than waiting on an in-process signal.
+    version is the one this cycle's devices were loaded at; None (the
+    devices could not be loaded) just sleeps the full interval.
+    """
+    deadline = time.monotonic() + FETCH_INTERVAL
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(DEVICE_CHECK_INTERVAL, remaining))
+        try:
+            if version is not None and get_devices_version() != version:
+                logger.info("Device configuration changed, fetching now")
+                return
+        except sqlite3.Error as e:
+            logger.error(f"Error checking device version: {e}")
 
 
 def start_background_thread():
     """Start the background data fetcher thread if not already started."""
-    global _background_thread_started
-    if not _background_thread_started:
+    if _bg_started.is_set():
+        return
+
+    with _bg_lock:
+        if _bg_started.is_set():
+            return
+
         # Initialize database
         init_database()
 
@@ -285,7 +508,7 @@ def start_background_thread():
         fetcher_thread.start()
         logger.info("Background data fetcher started")
 
-        _background_thread_started = True
+        _bg_started.set()
 
 
 def get_devices():
@@ -299,21 +522,27 @@ def get_devices():
         fetch_all=True,
     )
 
-    return [{"id": row[0], "name": row[1], "provider": row[2]} for row in rows]
+    return [dict(row) for row in rows]
 
 
 def get_latest_measurement(device_id=None):
-    """Get the most recent measurement from database."""
-    conn = sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
-    cursor = conn.cursor()
+    """Get the most recent measurement from database.
+
+    A device's rows are inserted in time order, so its highest id is its
+    latest one. Across devices, a fetch cycle inserts rows in completion
+    order, so the all-devices query still sorts by timestamp.
+    """
+    cursor = get_db_connection().cursor()
 
     if device_id:
         cursor.execute(
             """
-            SELECT m.*, d.name as device_name FROM measurements m
+            SELECT m.id, m.device_id, m.timestamp, m.pm1, m.pm2, m.pm10, m.co2,
+                   m.temperature, m.humidity, m.nox, m.tvoc, d.name AS device_name
+            FROM measurements m
             JOIN devices d ON m.device_id = d.id 
             WHERE m.device_id = ?
-            ORDER BY m.timestamp DESC 
+            ORDER BY m.id DESC 
             LIMIT 1
         """,
             (device_id,),
@@ -322,80 +551,93 @@ def get_latest_measurement(device_id=None):
         # Get latest from any device
         cursor.execute(
             """
-            SELECT m.*, d.name as device_name FROM measurements m
+            SELECT m.id, m.device_id, m.timestamp, m.pm1, m.pm2, m.pm10, m.co2,
+                   m.temperature, m.humidity, m.nox, m.tvoc, d.name AS device_name
+            FROM measurements m
             JOIN devices d ON m.device_id = d.id
-            ORDER BY m.timestamp DESC 
+            ORDER BY m.timestamp_epoch DESC 
             LIMIT 1
         """
         )
 
     row = cursor.fetchone()
-    conn.close()
 
     if row:
-        return {
-            "id": row[0],
-            "device_id": row[1],
-            "timestamp": row[2],  # UTC timestamp from storage
-            "pm1": row[3],
-            "pm2": row[4],
-            "pm10": row[5],
-            "co2": row[6],
-            "temperature": row[7],
-            "humidity": row[8],
-            "nox": row[9],
-            "tvoc": row[10],
-            "device_name": row[11],
-        }
+        # Timestamp is the UTC value from storage
+        return dict(row)
     return None
 
 
 def get_historical_data(hours=24, device_id=None):
-    """Get historical data for the specified number of hours."""
-    conn = sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
-    cursor = conn.cursor()
+    """Get a cursor over historical data for the specified number of hours.
 
-    since = datetime.utcnow() - timedelta(hours=hours)
+    Ranges long enough to exceed HISTORY_MAX_POINTS readings per device are
+    averaged into time buckets; shorter ranges return the raw readings.
+    """
+    cursor = get_db_connection().cursor()
 
-    if device_id:
+    since = int(time.time()) - hours * 3600
+    bucket_seconds = hours * 3600 // HISTORY_MAX_POINTS
+    device_filter = "AND m.device_id = ?" if device_id else ""
+    params = (since, device_id) if device_id else (since,)
+
+    if bucket_seconds > FETCH_INTERVAL:
         cursor.execute(
-            """
-            SELECT m.timestamp, m.pm2, m.co2, m.temperature, m.humidity, m.tvoc, m.nox, d.name as device_name
+            f"""
+            SELECT
+                strftime(
+                    '%Y-%m-%d %H:%M:%S',
+                    m.timestamp_epoch / ? * ?,
+                    'unixepoch'
+                ) AS timestamp,
+                AVG(m.pm2) AS pm2, AVG(m.co2) AS co2, AVG(m.temperature) AS temperature,
+                AVG(m.humidity) AS humidity, AVG(m.tvoc) AS tvoc, AVG(m.nox) AS nox,
+                d.name AS device_name
             FROM measurements m
             JOIN devices d ON m.device_id = d.id
-            WHERE m.timestamp > ? AND m.device_id = ?
-            ORDER BY m.timestamp ASC
+            WHERE m.timestamp_epoch > ? {device_filter}
+            GROUP BY 1, m.device_id
+            ORDER BY 1 ASC
         """,
-            (since, device_id),
+            (bucket_seconds, bucket_seconds) + params,
         )
     else:
         cursor.execute(
-            """
+            f"""
             SELECT m.timestamp, m.pm2, m.co2, m.temperature, m.humidity, m.tvoc, m.nox, d.name as device_name
             FROM measurements m
             JOIN devices d ON m.device_id = d.id
-            WHERE m.timestamp > ? 
-            ORDER BY m.timestamp ASC
+            WHERE m.timestamp_epoch > ? {device_filter}
+            ORDER BY m.timestamp_epoch ASC
         """,
-            (since,),
+            params,
         )
 
-    rows = cursor.fetchall()
-    conn.close()
+    return cursor
 
-    return [
-        {
-            "timestamp": row[0],  # UTC timestamp from storage
-            "pm2": row[1],
-            "co2": row[2],
-            "temperature": row[3],
-            "humidity": row[4],
-            "tvoc": row[5],
-            "nox": row[6],
-            "device_name": row[7],
-        }
-        for row in rows
-    ]
+
+def stream_json_rows(cursor):
+    """Serialize cursor rows as a JSON array, yielding it in chunks."""
+    try:
+        yield b"["
+        separator = b""
+        while True:
+            rows = cursor.fetchmany(HISTORY_CHUNK_ROWS)
+            if not rows:
+                break
+            yield separator + b",".join(orjson.dumps(dict(row)) for row in rows)
+            separator = b","
+        yield b"]"
+    finally:
+        # The connection may now be closed on app context teardown
+        _db_local.streaming = False
+
+
+def ojsonify(obj):
+    """Serialize obj to a JSON response using orjson."""
+    return Response(
+        orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json"
+    )
 
 
 @app.route("/")
@@ -410,7 +652,7 @@ def dashboard():
 def api_devices():
     """API endpoint for device list."""
     devices = get_devices()
-    return jsonify(devices)
+    return ojsonify(devices)
 
 
 @app.route("/api/current")
@@ -420,7 +662,7 @@ def api_current(device_id=None):
     # Validate device_id if provided
     if device_id is not None:
         if device_id < 1:
-            return jsonify({"error": "Device ID must be a positive integer"}), 400
+            return ojsonify({"error": "Device ID must be a positive integer"}), 400
         
         # Check if device exists and is active
         device_exists = execute_db_query(
@@ -429,12 +671,12 @@ def api_current(device_id=None):
             fetch_one=True
         )
         if not device_exists:
-            return jsonify({"error": f"Active device with ID {device_id} not found"}), 404
+            return ojsonify({"error": f"Active device with ID {device_id} not found"}), 404
     
     data = get_latest_measurement(device_id)
     if data:
-        return jsonify(data)
-    return jsonify({"error": "No data available"}), 404
+        return ojsonify(data)
+    return ojsonify({"error": "No data available"}), 404
 
 
 @app.route("/api/history/<int:hours>")
@@ -443,12 +685,12 @@ def api_history(hours, device_id=None):
     """API endpoint for historical data."""
     # Validate hours parameter
     if hours < 1 or hours > 168:
-        return jsonify({"error": "Hours must be between 1 and 168"}), 400
+        return ojsonify({"error": "Hours must be between 1 and 168"}), 400
     
     # Validate device_id if provided
     if device_id is not None:
         if device_id < 1:
-            return jsonify({"error": "Device ID must be a positive integer"}), 400
+            return ojsonify({"error": "Device ID must be a positive integer"}), 400
         
         # Check if device exists and is active
         device_exists = execute_db_query(
@@ -457,10 +699,16 @@ def api_history(hours, device_id=None):
             fetch_one=True
         )
         if not device_exists:
-            return jsonify({"error": f"Active device with ID {device_id} not found"}), 404
-
-    data = get_historical_data(hours, device_id)
-    return jsonify(data)
+            return ojsonify({"error": f"Active device with ID {device_id} not found"}), 404
+
+    # Stream rows straight from the cursor rather than building the full list;
+    # the first app context teardown runs before streaming, so keep the
+    # connection open until stream_json_rows finishes
+    _db_local.streaming = True
+    cursor = get_historical_data(hours, device_id)
+    return Response(
+        stream_with_context(stream_json_rows(cursor)), mimetype="application/json"
+    )
 
 
 @app.route("/health")
@@ -468,42 +716,32 @@ def health_check():
     """Health check endpoint."""
     # Ensure background thread is running
     start_background_thread()
-    return jsonify({"status": "healthy", "timestamp": datetime.utcnow().isoformat()})
+    return ojsonify({"status": "healthy", "timestamp": datetime.utcnow().isoformat()})
 
 
 @app.route("/debug")
 def debug_timestamps():
     """Debug endpoint to see raw database timestamps."""
-    conn = sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
 
     cursor.execute(
         """
         SELECT m.timestamp, m.pm2, m.co2, d.name as device_name
         FROM measurements m
         JOIN devices d ON m.device_id = d.id
-        ORDER BY m.timestamp DESC 
+        ORDER BY m.timestamp_epoch DESC 
         LIMIT 5
     """
     )
 
     rows = cursor.fetchall()
-    conn.close()
 
     current_utc_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-    return jsonify(
+    return ojsonify(
         {
             "current_utc_time": current_utc_time,
-            "recent_records": [
-                {
-                    "timestamp": row[0],
-                    "pm2": row[1],
-                    "co2": row[2],
-                    "device_name": row[3],
-                }
-                for row in rows
-            ],
+            "recent_records": [dict(row) for row in rows],
         }
     )
 
@@ -529,13 +767,15 @@ def add_device(provider, name, token, location, validate, force):
         app.logger.error(f"Unknown provider '{provider}'. Supported: airgradient")
         return
 
-    # Build config based on provider
+    # Build config based on provider. AirGradient settings are read from their
+    # own columns but also kept in the JSON so older releases can read them
     config = {}
     if provider == "airgradient":
         if not token or not location:
             app.logger.error("AirGradient devices require --token and --location")
             return
         config = {"api_token": token, "location_id": location}
+    config_json = orjson.dumps(config).decode()
 
     # Get next available ID
     max_id = execute_db_query("SELECT MAX(id) FROM devices", fetch_one=True)[0]
@@ -544,12 +784,9 @@ def add_device(provider, name, token, location, validate, force):
     # Validate connection if requested
     if validate:
         print("Validating device connection...")
-        test_config = {
-            "id": device_id,
-            "name": name,
-            "provider": provider,
-            "config": config,
-        }
+        test_config = DeviceConfig(
+            device_id, name, provider, token, location, config_json
+        )
         try:
             adapter = create_device_adapter(test_config)
             data = adapter.fetch_data()
@@ -570,10 +807,10 @@ def add_device(provider, name, token, location, validate, force):
     try:
         execute_db_query(
             """
-            INSERT INTO devices (id, name, provider, config, active)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO devices (id, name, provider, api_token, location_id, config, active)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (device_id, name, provider, json.dumps(config), True),
+            (device_id, name, provider, token, location, config_json, True),
         )
         print(f"✓ Device '{name}' added successfully (ID: {device_id})")
     except sqlite3.Error as e:
@@ -628,8 +865,7 @@ def list_devices(all):
 @click.option("--force", is_flag=True, help="Skip confirmation")
 def remove_device(device_id, force):
     """Remove a device."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
 
     # Check if device exists
     cursor.execute("SELECT name FROM devices WHERE id = ?", (device_id,))
@@ -637,7 +873,6 @@ def remove_device(device_id, force):
 
     if not device:
         print(f"Error: Device with ID {device_id} not found")
-        conn.close()
         return
 
     device_name = device[0]
@@ -647,50 +882,40 @@ def remove_device(device_id, force):
         response = input(f"Remove device '{device_name}' (ID: {device_id})? [y/N]: ")
         if response.lower() != "y":
             print("Cancelled.")
-            conn.close()
             return
 
     # Remove device
     try:
-        cursor.execute("DELETE FROM devices WHERE id = ?", (device_id,))
-        conn.commit()
+        with db_writer() as conn:
+            conn.execute("DELETE FROM devices WHERE id = ?", (device_id,))
         print(f"✓ Device '{device_name}' removed successfully")
     except sqlite3.Error as e:
         print(f"Error removing device: {e}")
-    finally:
-        conn.close()
 
 
 @device.command("test")
 @click.argument("device_id", type=int)
 def test_device(device_id):
     """Test device connection."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
 
     cursor.execute(
-        "SELECT name, provider, config FROM devices WHERE id = ? AND active = 1",
+        """
+        SELECT name, provider, api_token, location_id, config
+        FROM devices WHERE id = ? AND active = 1
+        """,
         (device_id,),
     )
 
     device = cursor.fetchone()
-    conn.close()
 
     if not device:
         print(f"Error: Active device with ID {device_id} not found")
         return
 
-    name, provider, config_json = device
-    config = json.loads(config_json)
-
-    print(f"Testing device '{name}' (Provider: {provider})...")
+    test_config = DeviceConfig(device_id, *device)
 
-    test_config = {
-        "id": device_id,
-        "name": name,
-        "provider": provider,
-        "config": config,
-    }
+    print(f"Testing device '{test_config.name}' (Provider: {test_config.provider})...")
 
     try:
         adapter = create_device_adapter(test_config)
@@ -699,7 +924,7 @@ def test_device(device_id):
         if data:
             print("✓ Connection successful!")
             print(
-                f"Sample data: PM2.5={data.get('pm2')}, CO2={data.get('co2')}, Temp={data.get('temperature')}"
+                f"Sample data: PM2.5={data.pm2}, CO2={data.co2}, Temp={data.temperature}"
             )
         else:
             print("✗ Connection failed - no data received")
@@ -712,8 +937,7 @@ def test_device(device_id):
 @click.option("--force", is_flag=True, help="Skip confirmation")
 def deactivate_device(device_id, force):
     """Deactivate a device (stops data collection but keeps history)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
 
     # Check if device exists
     cursor.execute("SELECT name, active FROM devices WHERE id = ?", (device_id,))
@@ -721,14 +945,12 @@ def deactivate_device(device_id, force):
 
     if not device:
         print(f"Error: Device with ID {device_id} not found")
-        conn.close()
         return
 
     device_name, is_active = device
 
     if not is_active:
         print(f"Device '{device_name}' (ID: {device_id}) is already inactive")
-        conn.close()
         return
 
     # Confirm deactivation unless --force
@@ -736,27 +958,23 @@ def deactivate_device(device_id, force):
         response = input(f"Deactivate device '{device_name}' (ID: {device_id})? Data collection will stop but history will be preserved. [y/N]: ")
         if response.lower() != "y":
             print("Cancelled.")
-            conn.close()
             return
 
     # Deactivate device
     try:
-        cursor.execute("UPDATE devices SET active = 0 WHERE id = ?", (device_id,))
-        conn.commit()
+        with db_writer() as conn:
+            conn.execute("UPDATE devices SET active = 0 WHERE id = ?", (device_id,))
         print(f"✓ Device '{device_name}' deactivated successfully")
         print("  Data collection stopped. Historical data preserved.")
     except sqlite3.Error as e:
         print(f"Error deactivating device: {e}")
-    finally:
-        conn.close()
 
 
 @device.command("activate")
 @click.argument("device_id", type=int)
 def activate_device(device_id):
     """Activate a previously deactivated device."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = get_db_connection().cursor()
 
     # Check if device exists
     cursor.execute("SELECT name, active FROM devices WHERE id = ?", (device_id,))
@@ -764,26 +982,22 @@ def activate_device(device_id):
 
     if not device:
         print(f"Error: Device with ID {device_id} not found")
-        conn.close()
         return
 
     device_name, is_active = device
 
     if is_active:
         print(f"Device '{device_name}' (ID: {device_id}) is already active")
-        conn.close()
         return
 
     # Activate device
     try:
-        cursor.execute("UPDATE devices SET active = 1 WHERE id = ?", (device_id,))
-        conn.commit()
+        with db_writer() as conn:
+            conn.execute("UPDATE devices SET active = 1 WHERE id = ?", (device_id,))
         print(f"✓ Device '{device_name}' activated successfully")
         print("  Data collection will resume.")
     except sqlite3.Error as e:
         print(f"Error activating device: {e}")
-    finally:
-        conn.close()
 
 
 @app.cli.command("init-db")
@@ -797,24 +1011,86 @@ def init_db_command():
         print(f"Error initializing database: {e}")
 
 
+def _open_db_connection():
+    """Open a new database connection with the standard PRAGMAs applied."""
+    conn = sqlite3.connect(
+        app.config["DATABASE"],
+        check_same_thread=False,
+        cached_statements=256,
+        isolation_level=None,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
 def get_db_connection():
-    """Get database connection."""
-    return sqlite3.connect(app.config["DATABASE"], check_same_thread=False)
+    """Get this thread's database connection, opening it on first use.
+
+    Connections live as long as their thread. The main thread (which serves
+    requests under gunicorn's sync workers) and the data fetcher keep theirs
+    for good; other request threads, such as the Flask dev server's
+    thread-per-request, have theirs closed on app context teardown. Those
+    threads pay a connect plus DB_PRAGMAS per request, slightly more than a
+    bare connect, in exchange for never leaking connections.
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = _open_db_connection()
+        _db_local.conn = conn
+    return conn
+
+
+@app.teardown_appcontext
+def close_db_connection(exception):
+    """Close the database connection of short-lived request threads."""
+    if threading.current_thread() is threading.main_thread():
+        return
+    if getattr(_db_local, "streaming", False):
+        return
+
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
+
+
+@contextmanager
+def db_writer():
+    """Yield the shared writer connection inside a transaction.
+
+    All writes go through this single connection, serialized by a lock, so
+    concurrent API readers never see SQLITE_BUSY from competing writers.
+    Connections run in autocommit mode, so the transaction is explicit.
+    """
+    global _db_writer
+    with _db_write_lock:
+        if _db_writer is None:
+            _db_writer = _open_db_connection()
+        _db_writer.execute("BEGIN IMMEDIATE")
+        try:
+            yield _db_writer
+            _db_writer.execute("COMMIT")
+        except BaseException:
+            # Never leave the shared connection inside an open transaction
+            if _db_writer.in_transaction:
+                try:
+                    _db_writer.execute("ROLLBACK")
+                except sqlite3.Error as e:
+                    logger.error(f"Rollback failed: {e}")
+            raise
 
 
 def execute_db_query(query, params=None, fetch_one=False, fetch_all=False):
     """Execute database query with automatic connection handling."""
-    with sqlite3.connect(app.config["DATABASE"], check_same_thread=False) as conn:
-        cursor = conn.cursor()
+    if fetch_one or fetch_all:
+        cursor = get_db_connection().cursor()
         cursor.execute(query, params or ())
+        return cursor.fetchone() if fetch_one else cursor.fetchall()
 
-        if fetch_one:
-            return cursor.fetchone()
-        elif fetch_all:
-            return cursor.fetchall()
-
-        conn.commit()
-        return cursor
+    with db_writer() as conn:
+        return conn.execute(query, params or ())
 
 
 # For gunicorn compatibility - only start background thread in single-worker mode